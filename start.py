@@ -1,15 +1,604 @@
 import cv2
+import numpy as np
 import tkinter as tk
 from tkinter import ttk, filedialog
-from PIL import Image, ImageTk
+from PIL import Image, ImageDraw, ImageFont, ImageTk
 import threading
 import queue
 import time
 import datetime
 import os
+import sys
+import shutil
+import struct
+import subprocess
+from collections import OrderedDict, namedtuple
 import usb.core
 import usb.util
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INDEX_MAGIC = b'USBIDX2\0'
+INDEX_HEADER = struct.Struct('<dd')        # время начала, fps
+INDEX_FRAME = struct.Struct('<dIB')        # время, кадр, KEYFRAME_*
+INDEX_THUMB = struct.Struct('<dII')        # время, кадр, длина JPEG
+INDEX_END = struct.Struct('<I')            # всего кадров, пишется при закрытии
+# Флаг ключевого кадра: для кодеков с межкадровым сжатием OpenCV не сообщает,
+# какие кадры ключевые, поэтому кроме первого они помечаются как неизвестные
+KEYFRAME_NO = 0
+KEYFRAME_YES = 1
+KEYFRAME_UNKNOWN = 2
+
+
+class SeekIndexWriter:
+    # Сайдкар video_<timestamp>.idx: одна запись на секунду записи
+    # и миниатюры из превью с фиксированным интервалом. При переменной частоте
+    # кадров (пропуск статичных) пишется каждый сохранённый кадр, fps в заголовке = 0.
+    # Байтовых смещений нет: VideoWriter не сообщает, где в контейнере лежит кадр
+    def __init__(self, video_path, start_time, fps, keyframes_only=False,
+                 thumb_interval=10, thumb_width=160, variable_rate=False):
+        self.video_path = video_path
+        self.variable_rate = variable_rate
+        self.path = os.path.splitext(video_path)[0] + '.idx'
+        self.start_time = start_time
+        self.keyframes_only = keyframes_only
+        self.thumb_interval = thumb_interval
+        self.thumb_width = thumb_width
+        self.next_second = 0
+        self.next_thumb = 0
+        self.frame_no = 0
+        self.frame_total = 0
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'wb')
+        self.file.write(INDEX_MAGIC + INDEX_HEADER.pack(start_time, 0 if variable_rate else fps))
+
+    def add_frame(self, frame_no, wall_time):
+        self.frame_no = frame_no
+        self.frame_total = frame_no + 1
+        if not self.variable_rate:
+            if wall_time - self.start_time < self.next_second:
+                return
+            self.next_second = int(wall_time - self.start_time) + 1
+        if self.keyframes_only or frame_no == 0:
+            keyframe = KEYFRAME_YES
+        else:
+            keyframe = KEYFRAME_UNKNOWN
+        self.write(b'F' + INDEX_FRAME.pack(wall_time, frame_no, keyframe))
+
+    def add_thumbnail(self, preview, wall_time):
+        if wall_time - self.start_time < self.next_thumb:
+            return
+        self.next_thumb = int(wall_time - self.start_time) + self.thumb_interval
+        height = int(preview.shape[0] * self.thumb_width / preview.shape[1])
+        thumb = cv2.resize(preview, (self.thumb_width, height), interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        if not ok:
+            return
+        data = jpeg.tobytes()
+        self.write(b'T' + INDEX_THUMB.pack(wall_time, self.frame_no, len(data)) + data)
+
+    def write(self, record):
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(record)
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(b'E' + INDEX_END.pack(self.frame_total))
+                self.file.close()
+
+
+class SeekIndex:
+    # Чтение сайдкара: поиск кадра по времени за O(1) через посекундную таблицу
+    def __init__(self, path):
+        self.frames = []
+        self.thumbnails = []
+        # Без завершающей записи (сбой) число кадров неизвестно
+        self.frame_total = None
+        with open(path, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"Неверный формат индекса: {path}")
+            self.start_time, self.fps = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            # Файл после сбоя может оборваться посреди записи — читаем до последней целой
+            while True:
+                kind = f.read(1)
+                if kind == b'F':
+                    data = f.read(INDEX_FRAME.size)
+                    if len(data) < INDEX_FRAME.size:
+                        break
+                    self.frames.append(INDEX_FRAME.unpack(data))
+                elif kind == b'T':
+                    data = f.read(INDEX_THUMB.size)
+                    if len(data) < INDEX_THUMB.size:
+                        break
+                    wall_time, frame_no, length = INDEX_THUMB.unpack(data)
+                    jpeg = f.read(length)
+                    if len(jpeg) < length:
+                        break
+                    self.thumbnails.append((wall_time, frame_no, jpeg))
+                elif kind == b'E':
+                    data = f.read(INDEX_END.size)
+                    if len(data) == INDEX_END.size:
+                        self.frame_total = INDEX_END.unpack(data)[0]
+                    break
+                else:
+                    break
+
+        self.frame_table = self.second_table(self.frames)
+        self.thumb_table = self.second_table(self.thumbnails)
+
+    def second_table(self, entries):
+        # Таблица секунда -> индекс последней записи не позже этой секунды
+        table = []
+        for i, entry in enumerate(entries):
+            second = int(entry[0] - self.start_time)
+            while len(table) < second:
+                table.append(max(i - 1, 0))
+            if len(table) == second:
+                table.append(i)
+        return table
+
+    def lookup(self, table, wall_time):
+        second = min(max(int(wall_time - self.start_time), 0), len(table) - 1)
+        return table[second]
+
+    def duration(self):
+        return self.frames[-1][0] - self.start_time if self.frames else 0
+
+    def frame_at(self, wall_time):
+        if not self.frames:
+            return 0
+        i = self.lookup(self.frame_table, wall_time)
+        if not self.fps:
+            return self.frames[self.vfr_entry(wall_time)][1]
+        entry_time, frame_no = self.frames[i][0], self.frames[i][1]
+        if wall_time > entry_time:
+            if i + 1 < len(self.frames):
+                frame_no = min(frame_no + int((wall_time - entry_time) * self.fps),
+                               self.frames[i + 1][1] - 1)
+            else:
+                # После последней записи — не дальше одной секунды
+                frame_no += int(min(wall_time - entry_time, 1) * self.fps)
+        if self.frame_total:
+            frame_no = min(frame_no, self.frame_total - 1)
+        return frame_no
+
+    def vfr_entry(self, wall_time):
+        # Переменная частота: записи есть для каждого кадра, идём вперёд
+        # в пределах секунды до последнего кадра не позже wall_time
+        i = self.lookup(self.frame_table, wall_time)
+        while i + 1 < len(self.frames) and self.frames[i + 1][0] <= wall_time:
+            i += 1
+        return i
+
+    def thumbnail_at(self, wall_time):
+        if not self.thumbnails:
+            return None
+        data = self.thumbnails[self.lookup(self.thumb_table, wall_time)][2]
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def seek(self, cap, wall_time):
+        frame_no = self.frame_at(wall_time)
+        if self.fps or not self.frames:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+        else:
+            # В VFR-файле номер кадра не соответствует времени N / fps: ищем по метке
+            # времени, отсчитанной от первого кадра, как в файле timestamps для MKV
+            entry_time = self.frames[self.vfr_entry(wall_time)][0]
+            cap.set(cv2.CAP_PROP_POS_MSEC, (entry_time - self.frames[0][0]) * 1000)
+        return frame_no
+
+
+class FrameDeduplicator:
+    # Пропуск почти одинаковых кадров: сравнение уменьшенной серой копии
+    # с последним записанным кадром; раз в heartbeat секунд кадр пишется всегда
+    def __init__(self, threshold=2.0, heartbeat=1.0, size=(32, 18)):
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.size = size
+        self.last = None
+        self.last_time = 0
+        self.compared = 0
+        self.skipped = 0
+        self.compare_time = 0
+
+    def keep(self, frame, wall_time):
+        compare_start = time.perf_counter()
+        # Прореживание срезом (без копии) перед усреднением до size
+        step = max(frame.shape[1] // (self.size[0] * 8), 1)
+        small = cv2.resize(frame[::step, ::step], self.size, interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        keep = (self.last is None
+                or wall_time - self.last_time >= self.heartbeat
+                or cv2.absdiff(small, self.last).mean() > self.threshold)
+        self.compare_time += time.perf_counter() - compare_start
+        self.compared += 1
+        if keep:
+            self.last = small
+            self.last_time = wall_time
+        else:
+            self.skipped += 1
+        return keep
+
+    def report(self, size):
+        if not self.compared:
+            return ""
+        kept = self.compared - self.skipped
+        saved = size * self.skipped // max(kept, 1)
+        return (f" | пропущено {self.skipped / self.compared:.0%} кадров "
+                f"(~{saved // 1024} KB сэкономлено), "
+                f"сравнение {self.compare_time / self.compared * 1e6:.0f} мкс/кадр")
+
+
+class EncoderWorker(threading.Thread):
+    # Отдельный поток кодирования для одной версии записи (мастер, прокси);
+    # все потоки получают один и тот же декодированный кадр
+    def __init__(self, name, writer, path, size, seek_index=None, timestamps=False,
+                 queue_size=30):
+        super().__init__(daemon=True)
+        self.name = name
+        self.writer = writer
+        self.path = path
+        self.size = size
+        self.seek_index = seek_index
+        self.timestamps = None
+        self.first_time = None
+        if timestamps:
+            # Реальные метки времени кадров в формате timestamp v2 (mkvmerge --timestamps)
+            self.timestamps = open(os.path.splitext(path)[0] + '.timestamps.txt', 'w')
+            self.timestamps.write("# timestamp format v2\n")
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.frames = 0
+        self.encode_time = 0
+        self.error = None
+        self.mux_error = None
+        self.stopped = False
+        self.start()
+
+    def submit(self, frame, frame_no, wall_time):
+        # Блокирующая постановка: при отставании кодировщика тормозим захват, а не теряем кадры
+        while not self.stopped:
+            try:
+                self.queue.put((frame, frame_no, wall_time), timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            frame, frame_no, wall_time = item
+            try:
+                encode_start = time.perf_counter()
+                if (frame.shape[1], frame.shape[0]) != self.size:
+                    frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                self.writer.write(frame)
+                self.encode_time += time.perf_counter() - encode_start
+                self.frames += 1
+                if self.seek_index is not None:
+                    self.seek_index.add_frame(frame_no, wall_time)
+                if self.timestamps is not None:
+                    if self.first_time is None:
+                        self.first_time = wall_time
+                    self.timestamps.write(f"{(wall_time - self.first_time) * 1000:.3f}\n")
+            except Exception as e:
+                self.error = e
+
+    def throughput(self):
+        return self.frames / self.encode_time if self.encode_time else 0
+
+    def stop(self):
+        self.stopped = True
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        try:
+            self.writer.release()
+        except:
+            pass
+        if self.timestamps is not None and not self.timestamps.closed:
+            self.timestamps.close()
+
+    def mux_vfr(self):
+        # OpenCV пишет только постоянную частоту кадров: пересобираем файл в MKV
+        # с реальными метками времени, чтобы пропуски не ускоряли воспроизведение.
+        # None — пересобирать нечего, True — готово, False — ошибка (в mux_error)
+        if self.timestamps is None:
+            return None
+        timestamps_path = self.timestamps.name
+        try:
+            if not self.frames:
+                return None
+            mkvmerge = shutil.which('mkvmerge')
+            if mkvmerge is None:
+                self.mux_error = "mkvmerge не найден"
+                return False
+            mkv_path = os.path.splitext(self.path)[0] + '.mkv'
+            try:
+                result = subprocess.run(
+                    [mkvmerge, '-q', '-o', mkv_path, '--timestamps', f'0:{timestamps_path}',
+                     self.path],
+                    capture_output=True)
+            except OSError as e:
+                self.mux_error = str(e)
+                return False
+            # Код 1 у mkvmerge — предупреждения, файл создан
+            if result.returncode not in (0, 1) or not os.path.exists(mkv_path):
+                self.mux_error = f"mkvmerge: код {result.returncode}"
+                if os.path.exists(mkv_path):
+                    os.remove(mkv_path)
+                return False
+            os.remove(self.path)
+            self.path = mkv_path
+            return True
+        finally:
+            if os.path.exists(timestamps_path):
+                os.remove(timestamps_path)
+
+
+# V4L2: перечисление форматов, размеров и интервалов кадра (linux/videodev2.h)
+VIDIOC_ENUM_FMT = 0xC0405602
+VIDIOC_ENUM_FRAMESIZES = 0xC02C564A
+VIDIOC_ENUM_FRAMEINTERVALS = 0xC034564B
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_FMT_FLAG_COMPRESSED = 0x1
+V4L2_FMT_FLAG_EMULATED = 0x2
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+V4L2_FMTDESC = struct.Struct('<III32sII3I')
+V4L2_FRMSIZEENUM = struct.Struct('<III6I2I')
+V4L2_FRMIVALENUM = struct.Struct('<IIIII6I2I')
+# Для ступенчатых/непрерывных диапазонов берём стандартные размеры
+STEPWISE_SIZES = [(640, 480), (1280, 720), (1920, 1080), (2560, 1440), (3840, 2160)]
+
+# Форматы, которые бэкенд V4L2 в OpenCV умеет преобразовать в BGR;
+# H264, HEVC и т.п. он не декодирует — такие режимы не выбираем
+OPENCV_PIXEL_FORMATS = {
+    'MJPG', 'JPEG', 'YUYV', 'UYVY', 'NV12', 'NV21', 'YU12', 'YV12',
+    'BGR3', 'RGB3', 'GREY', 'Y16 '
+}
+
+CaptureMode = namedtuple('CaptureMode', 'fourcc width height fps compressed')
+capture_mode_cache = {}
+
+
+def v4l2_enum(fd, request, layout, fields, ioctl):
+    # Вызывает ioctl с index = 0, 1, ... пока драйвер не вернёт EINVAL
+    index = 0
+    while True:
+        buf = bytearray(layout.size)
+        # Ведущие поля всех структур — u32: index, затем type/pixel_format/width/height
+        struct.pack_into(f'<{len(fields) + 1}I', buf, 0, index, *fields)
+        try:
+            ioctl(fd, request, buf, True)
+        except OSError:
+            return
+        yield layout.unpack(bytes(buf))
+        index += 1
+
+
+def enumerate_v4l2_modes(fd, ioctl=None):
+    ioctl = ioctl or fcntl.ioctl
+    modes = []
+    for fmt in v4l2_enum(fd, VIDIOC_ENUM_FMT, V4L2_FMTDESC, (V4L2_BUF_TYPE_VIDEO_CAPTURE,), ioctl):
+        flags, pixelformat = fmt[2], fmt[4]
+        if flags & V4L2_FMT_FLAG_EMULATED:
+            # Формат эмулируется libv4l программной конверсией — пропускаем
+            continue
+        fourcc = struct.pack('<I', pixelformat).decode('ascii', 'replace')
+        compressed = bool(flags & V4L2_FMT_FLAG_COMPRESSED)
+        for size in v4l2_enum(fd, VIDIOC_ENUM_FRAMESIZES, V4L2_FRMSIZEENUM, (pixelformat,), ioctl):
+            if size[2] == V4L2_FRMSIZE_TYPE_DISCRETE:
+                sizes = [(size[3], size[4])]
+            else:
+                min_w, max_w, _, min_h, max_h, _ = size[3:9]
+                sizes = [(w, h) for w, h in STEPWISE_SIZES
+                         if min_w <= w <= max_w and min_h <= h <= max_h]
+            for width, height in sizes:
+                fps = 0
+                for ival in v4l2_enum(fd, VIDIOC_ENUM_FRAMEINTERVALS, V4L2_FRMIVALENUM,
+                                      (pixelformat, width, height), ioctl):
+                    # Для диапазона интервалов минимальный интервал идёт первым
+                    numerator, denominator = ival[5], ival[6]
+                    if numerator:
+                        fps = max(fps, denominator / numerator)
+                    if ival[4] != V4L2_FRMIVAL_TYPE_DISCRETE:
+                        break
+                modes.append(CaptureMode(fourcc, width, height, fps, compressed))
+    return modes
+
+
+def get_capture_modes(index, ioctl=None):
+    # Режимы камеры перечисляются один раз на устройство и кэшируются
+    if index in capture_mode_cache:
+        return capture_mode_cache[index]
+    modes = []
+    if sys.platform.startswith('linux') and (fcntl is not None or ioctl is not None):
+        try:
+            fd = os.open(f"/dev/video{index}", os.O_RDWR | os.O_NONBLOCK)
+            try:
+                modes = enumerate_v4l2_modes(fd, ioctl)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Ошибка V4L2: {str(e)}")
+    capture_mode_cache[index] = modes
+    return modes
+
+
+def usable_modes(modes):
+    return [m for m in modes if m.fourcc in OPENCV_PIXEL_FORMATS]
+
+
+def choose_capture_mode(modes, resolution, fps):
+    # Только родной размер (без масштабирования в драйвере) и формат, понятный OpenCV;
+    # из режимов с полной частотой предпочитаем несжатый (без декодирования JPEG),
+    # затем MJPG, иначе — самый быстрый
+    candidates = [m for m in usable_modes(modes) if (m.width, m.height) == tuple(resolution)]
+    if not candidates:
+        return None
+    full_rate = [m for m in candidates if m.fps >= fps]
+    if full_rate:
+        return min(full_rate, key=lambda m: (m.compressed, m.fourcc != 'MJPG', -m.fps))
+    return max(candidates, key=lambda m: (m.fps, not m.compressed, m.fourcc == 'MJPG'))
+
+
+def choose_default_resolution(modes, resolutions, preferred, fps):
+    # Привычное разрешение по умолчанию, если камера его поддерживает;
+    # иначе самое большое, на котором есть полная частота кадров
+    if preferred in resolutions:
+        return preferred
+    full_rate = []
+    for resolution in resolutions:
+        mode = choose_capture_mode(modes, resolution, fps)
+        if mode is not None and mode.fps >= fps:
+            full_rate.append(resolution)
+    if full_rate:
+        return max(full_rate, key=lambda r: r[0] * r[1])
+    return max(resolutions, key=lambda r: r[0] * r[1])
+
+
+# Настройки захвата передаются потоку неизменяемым кортежем:
+# GUI подменяет ссылку целиком, поток читает её без блокировки
+CaptureConfig = namedtuple('CaptureConfig', 'camera resolution preview_size requested_at')
+
+
+class CapturePool:
+    # Недавно использованные камеры остаются открытыми и настроенными,
+    # переключение на них — просто смена ссылки
+    def __init__(self, max_size=2):
+        self.max_size = max_size
+        self.handles = OrderedDict()
+
+    def put(self, camera, cap, resolution):
+        if camera in self.handles:
+            self.handles.pop(camera)[0].release()
+        self.handles[camera] = (cap, resolution)
+        while len(self.handles) > self.max_size:
+            _, (old_cap, _) = self.handles.popitem(last=False)
+            old_cap.release()
+
+    def take(self, camera):
+        return self.handles.pop(camera, (None, None))
+
+    def clear(self):
+        for cap, _ in self.handles.values():
+            cap.release()
+        self.handles.clear()
+
+
+OVERLAY_FONTS = [
+    'DejaVuSansMono.ttf',
+    '/System/Library/Fonts/Menlo.ttc',
+    '/System/Library/Fonts/Monaco.ttf',
+    'Courier New.ttf',
+    'cour.ttf'
+]
+
+
+class TextOverlay:
+    # Штамп времени и имени камеры: атлас глифов рисуется один раз,
+    # в кадр копируется только готовая полоса, в ней меняются лишь изменившиеся символы
+    def __init__(self, frame_size, label, margin=16, min_font_size=6):
+        width, height = frame_size
+        self.time_format = '%Y-%m-%d %H:%M:%S'
+        time_len = len(datetime.datetime.now().strftime(self.time_format))
+        charset = sorted(set('0123456789-:| ' + label))
+        self.pad = 4
+        margin = min(margin, max(min(width, height) // 40, 2))
+
+        # Для маленького выхода (узкий ROI) уменьшаем шрифт, пока хотя бы время
+        # помещается в кадр; если не помещается и так — штамп невозможен (fits = False)
+        font_size = max(height // 40, 12)
+        while True:
+            font = self.load_font(font_size)
+            self.cell_w = max(int(font.getlength(c)) for c in charset) + 1
+            ascent, descent = font.getmetrics()
+            self.cell_h = ascent + descent
+            self.fits = (self.cell_h + 2 * self.pad + margin <= height and
+                         time_len * self.cell_w + 2 * self.pad + margin <= width)
+            if self.fits or font_size <= min_font_size:
+                break
+            font_size -= 1
+
+        self.atlas = np.zeros((len(charset), self.cell_h, self.cell_w, 3), dtype=np.uint8)
+        self.glyphs = {}
+        for i, char in enumerate(charset):
+            tile = Image.new('RGB', (self.cell_w, self.cell_h))
+            ImageDraw.Draw(tile).text((0, 0), char, font=font, fill=(255, 255, 255))
+            self.atlas[i] = np.asarray(tile)
+            self.glyphs[char] = i
+
+        text = ' ' * time_len + ' | ' + label
+        max_chars = max((width - margin - 2 * self.pad) // self.cell_w, time_len)
+        text = text[:max_chars]
+        self.region = np.zeros(
+            (self.cell_h + 2 * self.pad, len(text) * self.cell_w + 2 * self.pad, 3),
+            dtype=np.uint8)
+        for pos, char in enumerate(text):
+            self.blit(pos, char)
+        self.margin = margin
+        self.current_second = None
+        self.current_text = ' ' * time_len
+
+    def load_font(self, size):
+        for name in OVERLAY_FONTS:
+            try:
+                return ImageFont.truetype(name, size)
+            except OSError:
+                continue
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            return ImageFont.load_default()
+
+    def blit(self, pos, char):
+        x = self.pad + pos * self.cell_w
+        self.region[self.pad:self.pad + self.cell_h, x:x + self.cell_w] = \
+            self.atlas[self.glyphs.get(char, self.glyphs[' '])]
+
+    def apply(self, frame, wall_time):
+        second = int(wall_time)
+        if second != self.current_second:
+            self.current_second = second
+            text = datetime.datetime.fromtimestamp(second).strftime(self.time_format)
+            for pos, (old, new) in enumerate(zip(self.current_text, text)):
+                if old != new:
+                    self.blit(pos, new)
+            self.current_text = text
+
+        region_h, region_w = self.region.shape[:2]
+        y = frame.shape[0] - region_h - self.margin
+        if y < 0 or frame.shape[1] < region_w + self.margin:
+            return frame
+        frame[y:y + region_h, self.margin:self.margin + region_w] = self.region
+        return frame
+
+    def benchmark(self, frame_size, frames=300, fps=60):
+        # Среднее время на кадр и доля от интервала захвата при заданном fps
+        frame = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+        wall_time = time.time()
+        start = time.perf_counter()
+        for i in range(frames):
+            self.apply(frame, wall_time + i / fps)
+        per_frame = (time.perf_counter() - start) / frames
+        self.current_second = None
+        return per_frame, per_frame * fps
+
+
 class VideoRecorderApp:
     def __init__(self, root):
         self.root = root
@@ -21,7 +610,7 @@ class VideoRecorderApp:
             print("Ошибка: Не найдено ни одной камеры!")
             exit()
 
-        self.resolutions = [
+        self.default_resolutions = [
             (1280, 720),   # 1.3MP
             (1920, 1080)   # 2MP
         ]
@@ -45,20 +634,52 @@ class VideoRecorderApp:
             (1920, 1080): 8000
         }
         
+        self.frame_rate = 30
         self.current_camera = self.available_cameras[0]['index']
-        self.current_res = self.resolutions[0]
+        self.resolutions = self.camera_resolutions(self.current_camera)
+        self.current_res = self.default_resolution(self.current_camera)
         self.current_quality = 'Среднее'
         self.preview_size = self.calculate_preview_size(self.current_res)
         self.current_codec = self.codecs[0]
-        self.frame_rate = 30
         self.is_recording = False
         self.stop_thread = False
         self.output_file = ""
-        self.out = None
+        self.encoders = []
+        self.seek_index = None
+        self.overlay = None
         self.start_time = None
         self.last_sync = time.time()
         self.frame_count = 0
-        self.lock = threading.Lock()
+        self.capture_config = CaptureConfig(
+            self.current_camera, self.current_res, self.preview_size, time.perf_counter())
+        self.pool_enabled = False
+        self.capture_pool = CapturePool()
+        self.timelapse_intervals = [1, 2, 5, 10, 30, 60]
+        self.timelapse_fps_options = [10, 24, 30]
+        self.timelapse_interval = 5
+        self.timelapse_fps = 30
+        self.timelapse_active = False
+        self.timelapse_mode = 'grab'
+        self.next_shot = 0
+        self.warmup_cost = 0
+        self.flush_frames = 4
+        self.settle_frames = 15
+        self.settle_time = 1.0
+        self.wake_event = threading.Event()
+        self.output_sizes = [None, (640, 360), (1280, 720), (1920, 1080)]
+        self.output_size = None
+        self.roi = None
+        self.record_roi = None
+        self.record_size = self.current_res
+        self.drag_start = None
+        self.drag_rect = None
+        self.encode_stats = {}
+        self.recording_notes = ""
+        self.proxy_height = 360
+        self.proxy_codec = ('MPEG-4 (.mp4)', 'mp4v', 'mp4')
+        self.dedup_thresholds = [1, 2, 4, 8]
+        self.dedup_threshold = 2
+        self.dedup = None
         
         self.create_widgets()
         self.frame_queue = queue.Queue(maxsize=1)
@@ -131,8 +752,7 @@ class VideoRecorderApp:
         
         self.camera_combo = ttk.Combobox(
             control_frame,
-            values=[f"{cam['name']} [VID:{cam['vendor_id']} PID:{cam['product_id']}]" 
-                   for cam in self.available_cameras],
+            values=[self.camera_label(cam) for cam in self.available_cameras],
             state="readonly",
             width=40
         )
@@ -142,11 +762,11 @@ class VideoRecorderApp:
         
         self.res_combo = ttk.Combobox(
             control_frame,
-            values=[f"{w}x{h} ({w*h/1e6:.1f}MP)" for w, h in self.resolutions],
+            values=self.resolution_labels(),
             state="readonly",
-            width=18
+            width=32
         )
-        self.res_combo.current(0)
+        self.res_combo.current(self.resolutions.index(self.current_res))
         self.res_combo.bind("<<ComboboxSelected>>", self.update_resolution)
         self.res_combo.pack(side=tk.LEFT, padx=5)
         
@@ -170,6 +790,14 @@ class VideoRecorderApp:
         self.quality_combo.bind("<<ComboboxSelected>>", self.update_quality)
         self.quality_combo.pack(side=tk.LEFT, padx=5)
         
+        self.overlay_var = tk.BooleanVar(value=True)
+        self.overlay_check = ttk.Checkbutton(
+            control_frame,
+            text="Штамп",
+            variable=self.overlay_var
+        )
+        self.overlay_check.pack(side=tk.LEFT, padx=5)
+        
         self.rec_btn = ttk.Button(
             control_frame,
             text="Начать запись",
@@ -184,63 +812,381 @@ class VideoRecorderApp:
         )
         exit_btn.pack(side=tk.LEFT, padx=5)
         
+        options_frame = ttk.Frame(self.root)
+        options_frame.pack(pady=(0, 10))
+        
+        self.timelapse_var = tk.BooleanVar(value=False)
+        self.timelapse_check = ttk.Checkbutton(
+            options_frame,
+            text="Таймлапс",
+            variable=self.timelapse_var
+        )
+        self.timelapse_check.pack(side=tk.LEFT, padx=5)
+        
+        self.interval_combo = ttk.Combobox(
+            options_frame,
+            values=[f"каждые {i} с" for i in self.timelapse_intervals],
+            state="readonly",
+            width=12
+        )
+        self.interval_combo.current(self.timelapse_intervals.index(self.timelapse_interval))
+        self.interval_combo.bind("<<ComboboxSelected>>", self.update_timelapse)
+        self.interval_combo.pack(side=tk.LEFT, padx=5)
+        
+        self.timelapse_fps_combo = ttk.Combobox(
+            options_frame,
+            values=[f"{fps} fps" for fps in self.timelapse_fps_options],
+            state="readonly",
+            width=8
+        )
+        self.timelapse_fps_combo.current(self.timelapse_fps_options.index(self.timelapse_fps))
+        self.timelapse_fps_combo.bind("<<ComboboxSelected>>", self.update_timelapse)
+        self.timelapse_fps_combo.pack(side=tk.LEFT, padx=5)
+        
+        self.output_combo = ttk.Combobox(
+            options_frame,
+            values=["Выход: как ROI"] + [f"Выход: {w}x{h}" for w, h in self.output_sizes[1:]],
+            state="readonly",
+            width=16
+        )
+        self.output_combo.current(0)
+        self.output_combo.bind("<<ComboboxSelected>>", self.update_output_size)
+        self.output_combo.pack(side=tk.LEFT, padx=5)
+        
+        self.proxy_var = tk.BooleanVar(value=False)
+        self.proxy_check = ttk.Checkbutton(
+            options_frame,
+            text=f"Прокси {self.proxy_height}p",
+            variable=self.proxy_var
+        )
+        self.proxy_check.pack(side=tk.LEFT, padx=5)
+        
+        self.dedup_var = tk.BooleanVar(value=False)
+        self.dedup_check = ttk.Checkbutton(
+            options_frame,
+            text="Пропуск статичных",
+            variable=self.dedup_var
+        )
+        self.dedup_check.pack(side=tk.LEFT, padx=5)
+        
+        self.pool_var = tk.BooleanVar(value=self.pool_enabled)
+        self.pool_check = ttk.Checkbutton(
+            options_frame,
+            text="Пул устройств",
+            variable=self.pool_var,
+            command=self.update_pool
+        )
+        self.pool_check.pack(side=tk.LEFT, padx=5)
+        
+        self.threshold_combo = ttk.Combobox(
+            options_frame,
+            values=[f"порог {t}" for t in self.dedup_thresholds],
+            state="readonly",
+            width=8
+        )
+        self.threshold_combo.current(self.dedup_thresholds.index(self.dedup_threshold))
+        self.threshold_combo.bind("<<ComboboxSelected>>", self.update_threshold)
+        self.threshold_combo.pack(side=tk.LEFT, padx=5)
+        
         self.video_label = tk.Label(self.root)
         self.video_label.pack(padx=10, pady=10)
+        # Выделение ROI мышью на превью, правая кнопка — сброс
+        self.video_label.bind("<ButtonPress-1>", self.start_roi_drag)
+        self.video_label.bind("<B1-Motion>", self.update_roi_drag)
+        self.video_label.bind("<ButtonRelease-1>", self.finish_roi_drag)
+        self.video_label.bind("<Button-2>", self.reset_roi)
+        self.video_label.bind("<Button-3>", self.reset_roi)
         
         self.status_bar = ttk.Label(self.root, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
-    def calculate_bitrate(self):
-        base_bitrate = self.base_bitrates[self.current_res]
+    def camera_label(self, cam):
+        return f"{cam['name']} [VID:{cam['vendor_id']} PID:{cam['product_id']}]"
+
+    def camera_resolutions(self, camera):
+        # Размеры из перечисленных режимов камеры; без V4L2 — стандартный список
+        modes = usable_modes(get_capture_modes(camera))
+        sizes = sorted({(m.width, m.height) for m in modes}, key=lambda r: r[0] * r[1])
+        return sizes or list(self.default_resolutions)
+
+    def default_resolution(self, camera):
+        return choose_default_resolution(get_capture_modes(camera), self.resolutions,
+                                         self.default_resolutions[0], self.frame_rate)
+
+    def resolution_labels(self):
+        modes = get_capture_modes(self.current_camera)
+        labels = []
+        for w, h in self.resolutions:
+            mode = choose_capture_mode(modes, (w, h), self.frame_rate)
+            label = f"{w}x{h} ({w*h/1e6:.1f}MP)"
+            if mode is not None:
+                label = f"{w}x{h} ({w*h/1e6:.1f}MP, {mode.fps:.0f} fps {mode.fourcc})"
+            labels.append(label)
+        return labels
+
+    def calculate_bitrate(self, size=None):
+        base_bitrate = self.base_bitrates.get(self.current_res)
+        if base_bitrate is None:
+            # Для разрешений вне таблицы — пропорционально 2MP
+            base_bitrate = self.base_bitrates[(1920, 1080)] * (
+                self.current_res[0] * self.current_res[1] / (1920 * 1080))
+        if size is not None:
+            # Битрейт пропорционален числу пикселей на выходе
+            base_bitrate *= size[0] * size[1] / (self.current_res[0] * self.current_res[1])
         return int(base_bitrate * self.quality_presets[self.current_quality])
 
+    def calculate_output_size(self, roi):
+        if self.output_size is not None:
+            return self.output_size
+        if roi is None:
+            return self.current_res
+        # Большинство кодеков требуют чётных размеров
+        return (roi[2] & ~1, roi[3] & ~1)
+
+    def fit_roi(self, roi):
+        # Под заданный размер выхода ROI расширяется вокруг центра до его пропорций,
+        # чтобы масштабирование было равномерным, без растяжения
+        if self.output_size is None:
+            return roi
+        width, height = self.current_res
+        x, y, w, h = roi if roi is not None else (0, 0, width, height)
+        aspect = self.output_size[0] / self.output_size[1]
+        if w / h < aspect:
+            new_w, new_h = round(h * aspect), h
+        else:
+            new_w, new_h = w, round(w / aspect)
+        if new_w > width:
+            new_w, new_h = width, round(width / aspect)
+        if new_h > height:
+            new_w, new_h = round(height * aspect), height
+        new_w, new_h = new_w & ~1, new_h & ~1
+        new_x = min(max(x + (w - new_w) // 2, 0), width - new_w)
+        new_y = min(max(y + (h - new_h) // 2, 0), height - new_h)
+        return (new_x, new_y, new_w, new_h)
+
+    def crop_frame(self, frame):
+        # Обрезка — срез NumPy без копирования, масштабирование только при необходимости
+        roi = self.record_roi
+        if roi is not None:
+            x, y, w, h = roi
+            frame = frame[y:y + h, x:x + w]
+        height, width = frame.shape[:2]
+        if (width, height) != self.record_size:
+            shrink = self.record_size[0] < width
+            frame = cv2.resize(frame, self.record_size,
+                               interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+        return frame
+
+    def preview_scale(self):
+        return (self.current_res[0] / self.preview_size[0],
+                self.current_res[1] / self.preview_size[1])
+
+    def start_roi_drag(self, event):
+        if self.is_recording:
+            return
+        self.drag_start = (event.x, event.y)
+        self.drag_rect = None
+
+    def update_roi_drag(self, event):
+        if self.drag_start is None:
+            return
+        x0, y0 = self.drag_start
+        self.drag_rect = (min(x0, event.x), min(y0, event.y), max(x0, event.x), max(y0, event.y))
+
+    def finish_roi_drag(self, event):
+        if self.drag_start is None:
+            return
+        self.update_roi_drag(event)
+        x0, y0, x1, y1 = self.drag_rect
+        self.drag_start = None
+        self.drag_rect = None
+        scale_x, scale_y = self.preview_scale()
+        width, height = self.current_res
+        x = min(max(int(x0 * scale_x), 0), width)
+        y = min(max(int(y0 * scale_y), 0), height)
+        w = min(int((x1 - x0) * scale_x), width - x) & ~1
+        h = min(int((y1 - y0) * scale_y), height - y) & ~1
+        if w < 16 or h < 16:
+            self.reset_roi(event)
+            return
+        self.roi = (x, y, w, h)
+        self.update_status(f"ROI: {w}x{h} от ({x}, {y})")
+
+    def reset_roi(self, event=None):
+        if self.is_recording:
+            return
+        self.roi = None
+        self.update_status("ROI сброшен: записывается весь кадр")
+
+    def draw_roi(self, preview):
+        if self.drag_rect is not None:
+            x0, y0, x1, y1 = self.drag_rect
+        elif self.roi is not None or self.output_size is not None:
+            scale_x, scale_y = self.preview_scale()
+            x, y, w, h = self.fit_roi(self.roi)
+            x0, y0 = int(x / scale_x), int(y / scale_y)
+            x1, y1 = int((x + w) / scale_x), int((y + h) / scale_y)
+        else:
+            return
+        cv2.rectangle(preview, (x0, y0), (x1, y1), (0, 255, 255), 1)
+
+    def publish_config(self):
+        self.capture_config = CaptureConfig(
+            self.current_camera, self.current_res, self.preview_size, time.perf_counter())
+
+    def configure_camera(self, cap, camera, resolution):
+        mode = choose_capture_mode(get_capture_modes(camera), resolution, self.frame_rate)
+        if mode is not None:
+            # Формат задаётся до размера, иначе драйвер может выбрать медленный YUYV
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode.fourcc))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+        cap.set(cv2.CAP_PROP_FPS, self.frame_rate)
+        
+        actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return (actual_width, actual_height)
+
+    def open_camera(self, config):
+        # Время от открытия до пригодного кадра — стоимость «прогрева» камеры
+        opened_at = time.time()
+        cap = cv2.VideoCapture(config.camera)
+        if not cap.isOpened():
+            raise RuntimeError("Ошибка инициализации камеры")
+        
+        actual = self.configure_camera(cap, config.camera, config.resolution)
+        if actual != config.resolution:
+            self.update_status(f"Фактическое разрешение: {actual[0]}x{actual[1]}")
+        
+        if not cap.grab():
+            cap.release()
+            raise RuntimeError("Ошибка захвата кадра")
+        # Первые кадры UVC-камеры темные и без баланса белого, пока не сошлась
+        # автоэкспозиция: отбрасываем их (по числу кадров или по времени)
+        settle_start = time.time()
+        for _ in range(self.settle_frames):
+            if time.time() - settle_start > self.settle_time or not cap.grab():
+                break
+        self.warmup_cost = time.time() - opened_at
+        return cap
+
+    def switch_camera(self, cap, old, new):
+        # Ручка cap переходит сюда во владение: при ошибке она освобождается
+        # или уже лежит в пуле, вызывающий её больше не трогает
+        pool = self.capture_pool if self.pool_enabled else None
+        if cap is not None and old.camera == new.camera:
+            if old.resolution == new.resolution:
+                return cap, None
+            # Та же камера: перенастраиваем без переоткрытия
+            try:
+                actual = self.configure_camera(cap, new.camera, new.resolution)
+            except Exception:
+                cap.release()
+                raise
+            if actual == new.resolution:
+                return cap, "перенастройка"
+            cap.release()
+        elif cap is not None:
+            if pool is not None:
+                pool.put(old.camera, cap, old.resolution)
+            else:
+                cap.release()
+        
+        if pool is not None:
+            cap, resolution = pool.take(new.camera)
+            if cap is not None:
+                try:
+                    if (resolution == new.resolution or
+                            self.configure_camera(cap, new.camera, new.resolution) == new.resolution):
+                        # Отбрасываем кадры, накопившиеся в буфере, пока камера ждала в пуле
+                        for _ in range(self.flush_frames):
+                            cap.grab()
+                        return cap, "из пула"
+                except Exception:
+                    cap.release()
+                    raise
+                cap.release()
+        return self.open_camera(new), "открытие"
+
     def video_capture_thread(self):
         cap = None
-        prev_settings = (None, None, None)
+        prev_config = None
+        switched = None
         while not self.stop_thread:
             try:
-                with self.lock:
-                    current_settings = (
-                        self.current_camera,
-                        self.current_res,
-                        self.preview_size
-                    )
+                config = self.capture_config
+                if not self.pool_enabled and self.capture_pool.handles:
+                    self.capture_pool.clear()
                 
-                if prev_settings != current_settings:
-                    if cap is not None:
-                        cap.release()
-                    cap = cv2.VideoCapture(current_settings[0])
-                    if not cap.isOpened():
-                        raise RuntimeError("Ошибка инициализации камеры")
-                    
-                    cap.set(cv2.CAP_PROP_FRAME_WIDTH, current_settings[1][0])
-                    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, current_settings[1][1])
-                    cap.set(cv2.CAP_PROP_FPS, self.frame_rate)
-                    
-                    actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                    actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                    if (actual_width, actual_height) != current_settings[1]:
-                        self.update_status(f"Фактическое разрешение: {actual_width}x{actual_height}")
-                    
-                    prev_settings = current_settings
+                timelapse = self.is_recording and self.timelapse_active
+                if timelapse:
+                    # Спим до следующего кадра; в режиме переоткрытия камера закрыта
+                    reopen = self.timelapse_mode == 'reopen'
+                    lead = self.warmup_cost if reopen else 0
+                    wait = self.next_shot - lead - time.time()
+                    if wait > 0:
+                        if reopen and cap is not None:
+                            cap.release()
+                            cap = None
+                        self.wake_event.wait(wait)
+                        self.wake_event.clear()
+                        continue
+                
+                if cap is None:
+                    cap = self.open_camera(config)
+                    prev_config = config
+                elif config is not prev_config:
+                    old_cap, cap = cap, None
+                    cap, switched = self.switch_camera(old_cap, prev_config, config)
+                    prev_config = config
                 
-                ret, frame = cap.read()
+                if timelapse and self.timelapse_mode == 'grab':
+                    # Сбрасываем накопленные в буфере кадры, декодируем только последний
+                    for _ in range(self.flush_frames):
+                        cap.grab()
+                    ret, frame = cap.retrieve()
+                else:
+                    ret, frame = cap.read()
                 if not ret:
                     raise RuntimeError("Ошибка захвата кадра")
+                if switched is not None:
+                    latency = (time.perf_counter() - config.requested_at) * 1000
+                    self.update_status(f"Переключение: {latency:.0f} мс до первого кадра ({switched})")
+                    switched = None
+                if timelapse:
+                    self.next_shot = max(self.next_shot + self.timelapse_interval, time.time())
                 
-                if self.is_recording and self.out is not None:
+                now = time.time()
+                seek_index = self.seek_index
+                overlay = self.overlay
+                encoders = self.encoders
+                dedup = self.dedup
+                if self.is_recording and encoders:
                     try:
-                        self.out.write(frame)
-                        self.frame_count += 1
+                        output = self.crop_frame(frame)
+                        # Сравнение до наложения штампа, иначе каждая секунда — «новый» кадр
+                        if dedup is None or dedup.keep(output, now):
+                            if overlay is not None:
+                                overlay.apply(output, now)
+                            for encoder in encoders:
+                                if encoder.error is not None:
+                                    raise encoder.error
+                                encoder.submit(output, self.frame_count, now)
+                            self.frame_count += 1
                         
                         if time.time() - self.last_sync > 2:
+                            if seek_index is not None:
+                                seek_index.flush()
                             os.sync() if hasattr(os, 'sync') else None
                             self.last_sync = time.time()
                     except Exception as e:
                         self.update_status(f"Ошибка записи: {str(e)}")
                         self.stop_recording()
                 
-                resized = cv2.resize(frame, prev_settings[2])
+                resized = cv2.resize(frame, config.preview_size)
+                if seek_index is not None:
+                    seek_index.add_thumbnail(resized, now)
+                self.draw_roi(resized)
                 img = ImageTk.PhotoImage(image=Image.fromarray(
                     cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)))
                 
@@ -256,24 +1202,71 @@ class VideoRecorderApp:
         
         if cap is not None:
             cap.release()
-        if self.out is not None:
-            self.out.release()
+        self.capture_pool.clear()
+        for encoder in self.encoders:
+            encoder.stop()
+
+    def open_writer(self, path_base, codecs, fps, size, bitrate):
+        for codec in codecs:
+            codec_name, fourcc_code, ext = codec
+            try:
+                output_file = f"{path_base}.{ext}"
+                fourcc = cv2.VideoWriter_fourcc(*fourcc_code)
+                if fourcc == -1:
+                    continue
+                
+                out = cv2.VideoWriter(output_file, fourcc, fps, size, True)
+                if out.isOpened():
+                    try:
+                        out.set(cv2.VIDEOWRITER_PROP_BITRATE, bitrate)
+                    except:
+                        pass
+                    return out, output_file, codec
+            except:
+                continue
+        return None, None, None
+
+    def calculate_proxy_size(self, size):
+        width, height = size
+        if height <= self.proxy_height:
+            return None
+        return (int(self.proxy_height * width / height) & ~1, self.proxy_height)
 
     def update_camera(self, event):
         selected = self.camera_combo.current()
-        with self.lock:
-            self.current_camera = self.available_cameras[selected]['index']
+        self.current_camera = self.available_cameras[selected]['index']
+        self.resolutions = self.camera_resolutions(self.current_camera)
+        if self.current_res not in self.resolutions:
+            self.current_res = self.default_resolution(self.current_camera)
+            self.preview_size = self.calculate_preview_size(self.current_res)
+            self.roi = None
+        self.res_combo.config(values=self.resolution_labels())
+        self.res_combo.current(self.resolutions.index(self.current_res))
+        self.publish_config()
         self.update_status(f"Выбрана камера: {self.available_cameras[selected]['name']}")
 
     def update_resolution(self, event):
-        with self.lock:
-            new_res = self.resolutions[self.res_combo.current()]
-            self.current_res = new_res
-            self.preview_size = self.calculate_preview_size(new_res)
-        self.res_combo.config(state="disabled")
-        self.root.after(500, lambda: self.res_combo.config(state="readonly"))
+        new_res = self.resolutions[self.res_combo.current()]
+        self.current_res = new_res
+        self.preview_size = self.calculate_preview_size(new_res)
+        self.roi = None
+        self.publish_config()
         self.update_status(f"Установлено разрешение: {new_res[0]}x{new_res[1]}")
 
+    def update_output_size(self, event):
+        self.output_size = self.output_sizes[self.output_combo.current()]
+        size = self.calculate_output_size(self.roi)
+        self.update_status(f"Размер выхода: {size[0]}x{size[1]}")
+
+    def update_threshold(self, event):
+        self.dedup_threshold = self.dedup_thresholds[self.threshold_combo.current()]
+        self.update_status(f"Порог пропуска статичных кадров: {self.dedup_threshold}")
+
+    def update_pool(self):
+        self.pool_enabled = self.pool_var.get()
+        state = "включен" if self.pool_enabled else "выключен"
+        self.update_status(f"Пул устройств {state}: до {self.capture_pool.max_size} открытых камер")
+
     def update_codec(self, event):
         self.current_codec = self.codecs[self.codec_combo.current()]
         self.update_status(f"Выбран кодек: {self.current_codec[0]}")
@@ -282,6 +1275,12 @@ class VideoRecorderApp:
         self.current_quality = self.quality_combo.get()
         self.update_status(f"Качество: {self.current_quality}")
 
+    def update_timelapse(self, event):
+        self.timelapse_interval = self.timelapse_intervals[self.interval_combo.current()]
+        self.timelapse_fps = self.timelapse_fps_options[self.timelapse_fps_combo.current()]
+        self.update_status(
+            f"Таймлапс: кадр каждые {self.timelapse_interval} с, вывод {self.timelapse_fps} fps")
+
     def toggle_recording(self):
         if not self.is_recording:
             self.start_recording()
@@ -300,49 +1299,91 @@ class VideoRecorderApp:
             os.remove(test_path)
             
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-            target_bitrate = self.calculate_bitrate() * 1000
-            success = False
-            
-            for codec in [self.current_codec] + [c for c in self.codecs if c != self.current_codec]:
-                codec_name, fourcc_code, ext = codec
-                try:
-                    output_file = os.path.join(save_dir, f"video_{timestamp}.{ext}")
-                    fourcc = cv2.VideoWriter_fourcc(*fourcc_code)
-                    if fourcc == -1:
-                        continue
-                    
-                    out = cv2.VideoWriter(
-                        output_file,
-                        fourcc,
-                        self.frame_rate,
-                        self.current_res,
-                        True
-                    )
-                    
-                    if out.isOpened():
-                        try:
-                            out.set(cv2.VIDEOWRITER_PROP_BITRATE, target_bitrate)
-                        except:
-                            pass
-                        
-                        self.output_file = output_file
-                        self.out = out
-                        success = True
-                        if codec != self.current_codec:
-                            self.update_status(f"Используется кодек: {codec_name} (резервный)")
-                        break
-                except:
-                    continue
+            timelapse = self.timelapse_var.get()
+            output_fps = self.timelapse_fps if timelapse else self.frame_rate
+            capture_fps = 1 / self.timelapse_interval if timelapse else self.frame_rate
+            self.record_roi = self.fit_roi(self.roi)
+            self.record_size = self.calculate_output_size(self.roi)
+            target_bitrate = self.calculate_bitrate(self.record_size) * 1000
+            path_base = os.path.join(save_dir, f"video_{timestamp}")
             
-            if not success:
+            codecs = [self.current_codec] + [c for c in self.codecs if c != self.current_codec]
+            out, output_file, codec = self.open_writer(
+                path_base, codecs, output_fps, self.record_size, target_bitrate)
+            if out is None:
                 raise RuntimeError("Не удалось инициализировать запись")
+            if codec != self.current_codec:
+                self.update_status(f"Используется кодек: {codec[0]} (резервный)")
+            
+            dedup = self.dedup_var.get()
+            dedup_info = ""
+            if dedup and timelapse:
+                # Реальные метки времени свели бы таймлапс обратно к реальной скорости,
+                # а при интервале от 1 с контрольный кадр всё равно пишется каждый раз
+                dedup = False
+                dedup_info = " | пропуск статичных выключен в режиме таймлапса"
+            elif dedup and shutil.which('mkvmerge') is None:
+                # Без пересборки в MKV файл с пропусками играл бы быстрее реального времени
+                dedup = False
+                dedup_info = " | пропуск статичных выключен: нужен mkvmerge (MKVToolNix)"
+            
+            self.output_file = output_file
+            self.frame_count = 0
+            self.seek_index = SeekIndexWriter(
+                output_file, time.time(), capture_fps,
+                keyframes_only=(codec[1] == 'MJPG'),
+                variable_rate=dedup
+            )
+            encoders = [EncoderWorker("мастер", out, output_file, self.record_size,
+                                      self.seek_index, timestamps=dedup)]
+            
+            proxy_info = ""
+            proxy_size = self.calculate_proxy_size(self.record_size)
+            if self.proxy_var.get() and proxy_size is None:
+                proxy_info = (f" | прокси не создан: запись {self.record_size[0]}x"
+                              f"{self.record_size[1]} не больше {self.proxy_height}p")
+            elif self.proxy_var.get():
+                proxy_codecs = [self.proxy_codec] + [c for c in self.codecs if c != self.proxy_codec]
+                out, proxy_file, _ = self.open_writer(
+                    f"{path_base}_proxy", proxy_codecs, output_fps, proxy_size,
+                    self.calculate_bitrate(proxy_size) * 1000)
+                if out is not None:
+                    encoders.append(EncoderWorker("прокси", out, proxy_file, proxy_size,
+                                                  timestamps=dedup))
+                else:
+                    proxy_info = " | прокси не создан: нет доступного кодека"
+            self.encoders = encoders
+            self.recording_notes = dedup_info + proxy_info
+            self.dedup = FrameDeduplicator(self.dedup_threshold) if dedup else None
+            
+            overlay_info = ""
+            if self.overlay_var.get():
+                cam = next(c for c in self.available_cameras if c['index'] == self.current_camera)
+                overlay = TextOverlay(self.record_size, self.camera_label(cam))
+                if overlay.fits:
+                    per_frame, share = overlay.benchmark(self.record_size)
+                    overlay_info = f" | штамп {per_frame * 1000:.2f} мс/кадр ({share:.1%} от 60 fps)"
+                    self.overlay = overlay
+                else:
+                    overlay_info = (f" | штамп выключен: выход {self.record_size[0]}x"
+                                    f"{self.record_size[1]} слишком мал")
+                    self.recording_notes += overlay_info
+            
+            if timelapse:
+                # Переоткрываем камеру, только если пауза заметно дольше прогрева
+                self.timelapse_mode = (
+                    'reopen' if self.timelapse_interval > 3 * self.warmup_cost + 1 else 'grab')
+                self.next_shot = time.time()
+            self.timelapse_active = timelapse
             
             self.is_recording = True
             self.start_time = time.time()
+            self.wake_event.set()
             self.rec_btn.config(text="Остановить запись")
             self.disable_controls(True)
             self.update_status_timer()
-            self.update_status(f"Начата запись: {os.path.basename(self.output_file)}")
+            self.update_status(f"Начата запись: {os.path.basename(self.output_file)}"
+                               f"{overlay_info}{dedup_info}{proxy_info}")
             
         except Exception as e:
             self.update_status(f"Ошибка: {str(e)}")
@@ -350,25 +1391,86 @@ class VideoRecorderApp:
 
     def stop_recording(self):
         self.is_recording = False
-        if self.out is not None:
-            try:
-                self.out.release()
-            except:
-                pass
-            self.out = None
+        self.timelapse_active = False
+        self.wake_event.set()
+        self.overlay = None
+        encoders = self.encoders
+        self.encoders = []
+        for encoder in encoders:
+            encoder.stop()
+        if self.seek_index is not None:
+            self.seek_index.close()
+        
+        duration = time.time() - self.start_time if self.start_time else 0
+        mode = 'roi' if self.record_roi is not None or self.output_size is not None else 'full'
+        args = (encoders, self.output_file, self.seek_index, self.dedup,
+                duration, self.record_size, mode)
+        self.seek_index = None
+        self.dedup = None
+        if any(encoder.timestamps is not None for encoder in encoders):
+            # Пересборка многочасового файла занимает время — не блокируем окно
+            self.update_status("Сборка MKV с реальными метками времени...")
+            threading.Thread(target=self.finish_recording, args=args).start()
+        else:
+            self.finish_recording(*args)
         
-        if os.path.exists(self.output_file):
-            size = os.path.getsize(self.output_file)
+        self.rec_btn.config(text="Начать запись")
+        self.disable_controls(False)
+
+    def finish_recording(self, encoders, output_file, seek_index, dedup, duration,
+                         record_size, mode):
+        mux_errors = []
+        for encoder in encoders:
+            if encoder.mux_vfr() is False:
+                mux_errors.append(f"{encoder.name}: {encoder.mux_error}")
+        if encoders:
+            # После пересборки в MKV путь к файлу меняется
+            output_file = encoders[0].path
+        for encoder in encoders[1:]:
+            if os.path.exists(encoder.path) and os.path.getsize(encoder.path) <= 2048:
+                os.remove(encoder.path)
+        mux_info = ""
+        if mux_errors:
+            mux_info = (f" | MKV не собран ({'; '.join(mux_errors)}): "
+                        f"файл с пропусками играет быстрее реального времени")
+        if self.stop_thread:
+            return
+        
+        if os.path.exists(output_file):
+            size = os.path.getsize(output_file)
             if size > 2048:
-                self.update_status(f"Файл сохранен: {self.output_file} ({size//1024} KB)")
+                report = self.encode_report(size, encoders, dedup, duration, record_size, mode)
+                self.update_status(f"Файл сохранен: {output_file} ({size//1024} KB)"
+                                   f"{report}{mux_info}")
             else:
-                os.remove(self.output_file)
+                os.remove(output_file)
+                if seek_index is not None and os.path.exists(seek_index.path):
+                    os.remove(seek_index.path)
                 self.update_status("Ошибка: Файл слишком мал")
         else:
             self.update_status("Ошибка: Файл не создан")
-        
-        self.rec_btn.config(text="Начать запись")
-        self.disable_controls(False)
+
+    def encode_report(self, size, encoders, dedup, duration, record_size, mode):
+        # Размер на секунду записи и скорость кодирования каждой версии;
+        # сравнение с прошлой записью в другом режиме (с ROI / без ROI)
+        if not encoders or not encoders[0].throughput() or not duration:
+            return ""
+        stats = (size / 1024 / max(duration, 1), encoders[0].throughput())
+        self.encode_stats[mode] = stats
+        report = (f" | {encoders[0].name} {record_size[0]}x{record_size[1]}: "
+                  f"{size // 1024} KB, {stats[0]:.0f} KB/с, кодирование {stats[1]:.0f} fps")
+        other = 'full' if mode == 'roi' else 'roi'
+        if other in self.encode_stats:
+            label = "без ROI" if other == 'full' else "с ROI"
+            report += (f" ({label}: {self.encode_stats[other][0]:.0f} KB/с, "
+                       f"{self.encode_stats[other][1]:.0f} fps)")
+        for encoder in encoders[1:]:
+            rendition_size = os.path.getsize(encoder.path) if os.path.exists(encoder.path) else 0
+            report += (f" | {encoder.name} {encoder.size[0]}x{encoder.size[1]}: "
+                       f"{rendition_size // 1024} KB, {encoder.throughput():.0f} fps")
+        if dedup is not None:
+            report += dedup.report(size)
+        return report
 
     def disable_controls(self, disable):
         state = "disabled" if disable else "readonly"
@@ -376,6 +1478,15 @@ class VideoRecorderApp:
         self.res_combo.config(state=state)
         self.codec_combo.config(state=state)
         self.quality_combo.config(state=state)
+        self.interval_combo.config(state=state)
+        self.timelapse_fps_combo.config(state=state)
+        self.output_combo.config(state=state)
+        self.threshold_combo.config(state=state)
+        check_state = "disabled" if disable else "normal"
+        self.proxy_check.config(state=check_state)
+        self.dedup_check.config(state=check_state)
+        self.overlay_check.config(state=check_state)
+        self.timelapse_check.config(state=check_state)
 
     def update_status_timer(self):
         if self.is_recording:
@@ -383,10 +1494,17 @@ class VideoRecorderApp:
             mins, secs = divmod(elapsed, 60)
             size = os.path.getsize(self.output_file) if os.path.exists(self.output_file) else 0
             status_text = (
-                f"{self.current_codec[0]} | {self.current_res[0]}x{self.current_res[1]} | "
-                f"{self.current_quality} ({self.calculate_bitrate()}kbps) | "
+                f"{self.current_codec[0]} | {self.record_size[0]}x{self.record_size[1]} | "
+                f"{self.current_quality} ({self.calculate_bitrate(self.record_size)}kbps) | "
                 f"{mins:02d}:{secs:02d} | {size//1024} KB"
             )
+            if self.timelapse_active:
+                mode = "переоткрытие" if self.timelapse_mode == 'reopen' else "grab"
+                status_text += (
+                    f" | Таймлапс {self.timelapse_interval} с → {self.timelapse_fps} fps, "
+                    f"{self.frame_count} кадров ({mode}, прогрев {self.warmup_cost:.2f} с)"
+                )
+            status_text += self.recording_notes
             self.status_bar.config(text=status_text)
             self.root.after(1000, self.update_status_timer)
 
@@ -404,9 +1522,12 @@ class VideoRecorderApp:
     def safe_exit(self):
         self.stop_thread = True
         self.is_recording = False
+        self.wake_event.set()
         
-        if self.out is not None:
-            self.out.release()
+        for encoder in self.encoders:
+            encoder.stop()
+        if self.seek_index is not None:
+            self.seek_index.close()
         
         if self.video_thread.is_alive():
             self.video_thread.join(timeout=1)
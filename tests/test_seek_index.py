@@ -0,0 +1,128 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import start
+
+
+START = 1000.0
+
+
+class FakeCapture:
+    def __init__(self):
+        self.props = {}
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        return True
+
+
+class SeekIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.video_path = os.path.join(self.dir, "video_test.avi")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_cfr(self, seconds=10, fps=30, thumbnails=False, close=True):
+        writer = start.SeekIndexWriter(self.video_path, START, fps, keyframes_only=False,
+                                       thumb_interval=5)
+        preview = np.zeros((360, 640, 3), dtype=np.uint8)
+        for frame_no in range(seconds * fps):
+            wall_time = START + frame_no / fps
+            writer.add_frame(frame_no, wall_time)
+            if thumbnails:
+                # Яркость миниатюры кодирует момент её снятия
+                preview[:] = frame_no % 250
+                writer.add_thumbnail(preview, wall_time)
+        if close:
+            writer.close()
+        else:
+            writer.flush()
+        return writer
+
+    def write_vfr(self, times):
+        writer = start.SeekIndexWriter(self.video_path, START, 30, variable_rate=True)
+        for frame_no, wall_time in enumerate(times):
+            writer.add_frame(frame_no, wall_time)
+        writer.close()
+        return writer
+
+    def test_cfr_round_trip(self):
+        writer = self.write_cfr()
+        index = start.SeekIndex(writer.path)
+        self.assertEqual(index.fps, 30)
+        self.assertEqual(len(index.frames), 10)
+        self.assertEqual(index.frame_total, 300)
+        self.assertEqual(index.frame_at(START), 0)
+        self.assertEqual(index.frame_at(START + 4.5), 135)
+        self.assertEqual(index.frame_at(START - 5), 0)
+
+    def test_keyframes_only_first_known_for_inter_codecs(self):
+        writer = self.write_cfr(seconds=3)
+        index = start.SeekIndex(writer.path)
+        self.assertEqual([f[2] for f in index.frames],
+                         [start.KEYFRAME_YES, start.KEYFRAME_UNKNOWN, start.KEYFRAME_UNKNOWN])
+
+    def test_frame_at_clamped_to_last_frame(self):
+        writer = self.write_cfr()
+        index = start.SeekIndex(writer.path)
+        self.assertEqual(index.frame_at(START + 100), 299)
+
+    def test_truncated_trailing_record(self):
+        writer = self.write_cfr(close=False)
+        writer.file.close()
+        with open(writer.path, 'rb') as f:
+            data = f.read()
+        with open(writer.path, 'wb') as f:
+            f.write(data[:-5])
+        index = start.SeekIndex(writer.path)
+        self.assertEqual(len(index.frames), 9)
+        self.assertIsNone(index.frame_total)
+        self.assertEqual(index.frame_at(START + 4.5), 135)
+
+    def test_thumbnail_lookup(self):
+        writer = self.write_cfr(thumbnails=True)
+        index = start.SeekIndex(writer.path)
+        self.assertEqual(len(index.thumbnails), 2)
+        first = index.thumbnail_at(START + 2)
+        second = index.thumbnail_at(START + 7)
+        self.assertEqual(first.shape, (90, 160, 3))
+        self.assertLess(abs(int(first.mean()) - 0), 3)
+        self.assertLess(abs(int(second.mean()) - 150), 3)
+
+    def test_vfr_uses_kept_frame_times(self):
+        times = [START, START + 0.5, START + 3.2, START + 3.25, START + 10]
+        writer = self.write_vfr(times)
+        index = start.SeekIndex(writer.path)
+        self.assertEqual(index.fps, 0)
+        self.assertEqual(len(index.frames), len(times))
+        self.assertEqual([index.frame_at(START + t) for t in (0.2, 0.6, 3.22, 3.3, 9, 50)],
+                         [0, 1, 2, 3, 3, 4])
+
+    def test_cfr_seek_by_frame_number(self):
+        writer = self.write_cfr()
+        index = start.SeekIndex(writer.path)
+        cap = FakeCapture()
+        self.assertEqual(index.seek(cap, START + 4.5), 135)
+        self.assertEqual(cap.props, {start.cv2.CAP_PROP_POS_FRAMES: 135})
+
+    def test_vfr_seek_by_timestamp(self):
+        times = [START + 0.1, START + 0.5, START + 3.2, START + 3.25, START + 10]
+        writer = self.write_vfr(times)
+        index = start.SeekIndex(writer.path)
+        cap = FakeCapture()
+        self.assertEqual(index.seek(cap, START + 3.22), 2)
+        self.assertEqual(set(cap.props), {start.cv2.CAP_PROP_POS_MSEC})
+        self.assertAlmostEqual(cap.props[start.cv2.CAP_PROP_POS_MSEC], 3100, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import errno
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import start
+
+
+def fourcc(code):
+    return struct.unpack('<I', code.encode('ascii'))[0]
+
+
+class FakeV4L2:
+    # Имитация ioctl драйвера V4L2: заполняет структуры так же, как ядро,
+    # и возвращает EINVAL по окончании перечисления
+    def __init__(self, formats, sizes, intervals):
+        self.formats = formats        # [(fourcc, flags)]
+        self.sizes = sizes            # fourcc -> [('discrete', w, h) | ('stepwise', min_w, max_w, step_w, min_h, max_h, step_h)]
+        self.intervals = intervals    # (fourcc, w, h) -> [('discrete', num, den) | ('stepwise', min, max, step)]
+        self.calls = 0
+
+    def __call__(self, fd, request, buf, mutate):
+        self.calls += 1
+        if request == start.VIDIOC_ENUM_FMT:
+            index, buf_type = struct.unpack_from('<II', buf)
+            if buf_type != start.V4L2_BUF_TYPE_VIDEO_CAPTURE or index >= len(self.formats):
+                raise OSError(errno.EINVAL, "EINVAL")
+            code, flags = self.formats[index]
+            start.V4L2_FMTDESC.pack_into(buf, 0, index, buf_type, flags, code.encode(),
+                                         fourcc(code), 0, 0, 0, 0)
+        elif request == start.VIDIOC_ENUM_FRAMESIZES:
+            index, pixelformat = struct.unpack_from('<II', buf)
+            entries = self.sizes.get(self.code(pixelformat), [])
+            if index >= len(entries):
+                raise OSError(errno.EINVAL, "EINVAL")
+            kind, *values = entries[index]
+            if kind == 'discrete':
+                start.V4L2_FRMSIZEENUM.pack_into(buf, 0, index, pixelformat, 1,
+                                                 *values, 0, 0, 0, 0, 0, 0)
+            else:
+                start.V4L2_FRMSIZEENUM.pack_into(buf, 0, index, pixelformat, 3, *values, 0, 0)
+        elif request == start.VIDIOC_ENUM_FRAMEINTERVALS:
+            index, pixelformat, width, height = struct.unpack_from('<IIII', buf)
+            entries = self.intervals.get((self.code(pixelformat), width, height), [])
+            if index >= len(entries):
+                raise OSError(errno.EINVAL, "EINVAL")
+            kind, *values = entries[index]
+            if kind == 'discrete':
+                start.V4L2_FRMIVALENUM.pack_into(buf, 0, index, pixelformat, width, height, 1,
+                                                 *values, 0, 0, 0, 0, 0, 0)
+            else:
+                (min_num, min_den), (max_num, max_den), (step_num, step_den) = values
+                start.V4L2_FRMIVALENUM.pack_into(buf, 0, index, pixelformat, width, height, 3,
+                                                 min_num, min_den, max_num, max_den,
+                                                 step_num, step_den, 0, 0)
+        else:
+            raise OSError(errno.ENOTTY, "ENOTTY")
+
+    def code(self, pixelformat):
+        return struct.pack('<I', pixelformat).decode('ascii')
+
+
+def typical_uvc_camera():
+    # YUYV даёт полную частоту только на малых размерах, MJPG — везде
+    return FakeV4L2(
+        formats=[('YUYV', 0), ('MJPG', start.V4L2_FMT_FLAG_COMPRESSED),
+                 ('RGB3', start.V4L2_FMT_FLAG_EMULATED)],
+        sizes={
+            'YUYV': [('discrete', 640, 480), ('discrete', 1280, 720), ('discrete', 1920, 1080)],
+            'MJPG': [('discrete', 640, 480), ('discrete', 1280, 720), ('discrete', 1920, 1080)],
+            'RGB3': [('discrete', 640, 480)],
+        },
+        intervals={
+            ('YUYV', 640, 480): [('discrete', 1, 30), ('discrete', 1, 15)],
+            ('YUYV', 1280, 720): [('discrete', 1, 30), ('discrete', 1, 10)],
+            ('YUYV', 1920, 1080): [('discrete', 1, 5)],
+            ('MJPG', 640, 480): [('discrete', 1, 30)],
+            ('MJPG', 1280, 720): [('discrete', 1, 60), ('discrete', 1, 30)],
+            ('MJPG', 1920, 1080): [('discrete', 1, 30)],
+            ('RGB3', 640, 480): [('discrete', 1, 30)],
+        })
+
+
+class EnumerateModesTest(unittest.TestCase):
+    def test_discrete_sizes_and_intervals(self):
+        modes = start.enumerate_v4l2_modes(3, typical_uvc_camera())
+        self.assertIn(start.CaptureMode('YUYV', 1920, 1080, 5.0, False), modes)
+        self.assertIn(start.CaptureMode('MJPG', 1280, 720, 60.0, True), modes)
+        self.assertEqual(len(modes), 6)
+
+    def test_emulated_formats_are_skipped(self):
+        modes = start.enumerate_v4l2_modes(3, typical_uvc_camera())
+        self.assertNotIn('RGB3', {m.fourcc for m in modes})
+
+    def test_stepwise_sizes_use_standard_sizes_in_range(self):
+        camera = FakeV4L2(
+            formats=[('MJPG', start.V4L2_FMT_FLAG_COMPRESSED)],
+            sizes={'MJPG': [('stepwise', 320, 1920, 16, 240, 1080, 8)]},
+            intervals={})
+        modes = start.enumerate_v4l2_modes(3, camera)
+        self.assertEqual([(m.width, m.height) for m in modes],
+                         [(640, 480), (1280, 720), (1920, 1080)])
+
+    def test_stepwise_intervals_report_max_fps(self):
+        camera = FakeV4L2(
+            formats=[('YUYV', 0)],
+            sizes={'YUYV': [('discrete', 1280, 720)]},
+            intervals={('YUYV', 1280, 720): [('stepwise', (1, 60), (1, 5), (1, 1))]})
+        modes = start.enumerate_v4l2_modes(3, camera)
+        self.assertEqual(modes, [start.CaptureMode('YUYV', 1280, 720, 60.0, False)])
+
+    def test_no_formats(self):
+        self.assertEqual(start.enumerate_v4l2_modes(3, FakeV4L2([], {}, {})), [])
+
+
+class ChooseModeTest(unittest.TestCase):
+    def setUp(self):
+        self.modes = start.enumerate_v4l2_modes(3, typical_uvc_camera())
+
+    def test_uncompressed_preferred_at_full_rate_720p(self):
+        mode = start.choose_capture_mode(self.modes, (1280, 720), 30)
+        self.assertEqual((mode.fourcc, mode.fps), ('YUYV', 30.0))
+
+    def test_mjpg_chosen_when_yuyv_too_slow_1080p(self):
+        mode = start.choose_capture_mode(self.modes, (1920, 1080), 30)
+        self.assertEqual((mode.fourcc, mode.fps), ('MJPG', 30.0))
+
+    def test_mjpg_chosen_for_60fps_720p(self):
+        mode = start.choose_capture_mode(self.modes, (1280, 720), 60)
+        self.assertEqual((mode.fourcc, mode.fps), ('MJPG', 60.0))
+
+    def test_fastest_mode_when_none_reaches_rate(self):
+        mode = start.choose_capture_mode(self.modes, (1920, 1080), 60)
+        self.assertEqual((mode.fourcc, mode.fps), ('MJPG', 30.0))
+
+    def test_unsupported_size(self):
+        self.assertIsNone(start.choose_capture_mode(self.modes, (800, 600), 30))
+
+    def test_mjpg_preferred_over_h264_listed_first(self):
+        camera = FakeV4L2(
+            formats=[('YUYV', 0), ('H264', start.V4L2_FMT_FLAG_COMPRESSED),
+                     ('MJPG', start.V4L2_FMT_FLAG_COMPRESSED)],
+            sizes={fmt: [('discrete', 1920, 1080)] for fmt in ('YUYV', 'H264', 'MJPG')},
+            intervals={
+                ('YUYV', 1920, 1080): [('discrete', 1, 5)],
+                ('H264', 1920, 1080): [('discrete', 1, 30)],
+                ('MJPG', 1920, 1080): [('discrete', 1, 30)],
+            })
+        modes = start.enumerate_v4l2_modes(3, camera)
+        self.assertIn('H264', {m.fourcc for m in modes})
+        mode = start.choose_capture_mode(modes, (1920, 1080), 30)
+        self.assertEqual((mode.fourcc, mode.fps), ('MJPG', 30.0))
+
+    def test_formats_opencv_cannot_convert_are_never_chosen(self):
+        modes = [start.CaptureMode('H264', 1920, 1080, 30, True),
+                 start.CaptureMode('YUYV', 1920, 1080, 5, False)]
+        mode = start.choose_capture_mode(modes, (1920, 1080), 30)
+        self.assertEqual(mode.fourcc, 'YUYV')
+        self.assertIsNone(start.choose_capture_mode(modes[:1], (1920, 1080), 30))
+
+
+class DefaultResolutionTest(unittest.TestCase):
+    def test_keeps_preferred_when_supported(self):
+        modes = start.enumerate_v4l2_modes(3, typical_uvc_camera())
+        resolutions = sorted({(m.width, m.height) for m in modes})
+        self.assertEqual(
+            start.choose_default_resolution(modes, resolutions, (1280, 720), 30), (1280, 720))
+
+    def test_largest_full_rate_size_otherwise(self):
+        modes = [start.CaptureMode('YUYV', 160, 120, 30, False),
+                 start.CaptureMode('YUYV', 640, 480, 30, False),
+                 start.CaptureMode('YUYV', 2592, 1944, 5, False)]
+        resolutions = [(160, 120), (640, 480), (2592, 1944)]
+        self.assertEqual(
+            start.choose_default_resolution(modes, resolutions, (1280, 720), 30), (640, 480))
+
+
+class CaptureModeCacheTest(unittest.TestCase):
+    def tearDown(self):
+        start.capture_mode_cache.pop(99, None)
+
+    def test_modes_are_cached_per_device(self):
+        start.capture_mode_cache[99] = [start.CaptureMode('MJPG', 1280, 720, 30, True)]
+        camera = typical_uvc_camera()
+        self.assertEqual(start.get_capture_modes(99, camera), start.capture_mode_cache[99])
+        self.assertEqual(camera.calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()